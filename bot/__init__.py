@@ -1,6 +1,7 @@
 __all__ = [
     "config",
     "storage",
+    "redis_store",
     "session",
     "gemini",
     "handlers",
@@ -1,6 +1,7 @@
 import os
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+from telegram.ext import AIORateLimiter, ApplicationBuilder, CommandHandler, MessageHandler, filters
 from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 
 from .config import load_config
 from .storage import JsonStore
@@ -16,8 +17,13 @@ async def create_application():
     os.makedirs(cfg.data_dir, exist_ok=True)
     os.makedirs(cfg.logs_dir, exist_ok=True)
 
-    store = JsonStore(cfg.data_dir)
-    sessions = SessionManager(cfg.idle_timeout_minutes)
+    if cfg.storage_backend == "redis":
+        # redis is only required for this backend
+        from .redis_store import RedisStore
+
+        store = RedisStore(cfg.redis_url)
+    else:
+        store = JsonStore(cfg.data_dir)
     # Load system prompt if present
     system_prompt = ""
     if os.path.exists(cfg.system_prompt_path):
@@ -28,14 +34,71 @@ async def create_application():
             system_prompt = ""
 
     gemini = GeminiClient(cfg.gemini_api_key, system_prompt=system_prompt)
-    handlers = BotHandlers(store, sessions, gemini, cfg.retention_days, cfg.admins)
+
+    def on_session_drop(session):
+        # offloaded photos live in the Gemini File API until deleted
+        if session.uploaded_file:
+            gemini.delete_file_later(session.uploaded_file)
+
+    sessions = SessionManager(cfg.idle_timeout_minutes, on_drop=on_session_drop)
+    handlers = BotHandlers(store, sessions, gemini, cfg.admins)
+
+    async def on_shutdown(application):
+        store.close()
 
     app = (
         ApplicationBuilder()
         .token(cfg.telegram_token)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(cfg.concurrent_updates)
+        # outbound API calls (including file downloads) share one pool, multiplexed over HTTP/2;
+        # getUpdates gets its own single connection
+        .request(
+            HTTPXRequest(
+                connection_pool_size=cfg.connection_pool_size,
+                pool_timeout=cfg.pool_timeout,
+                connect_timeout=cfg.connect_timeout,
+                read_timeout=cfg.read_timeout,
+                http_version=cfg.http_version,
+            )
+        )
+        .get_updates_request(
+            HTTPXRequest(
+                connection_pool_size=1,
+                pool_timeout=cfg.get_updates_pool_timeout,
+                connect_timeout=cfg.connect_timeout,
+                http_version=cfg.http_version,
+            )
+        )
+        # queue outgoing messages within Telegram's flood limits instead of getting 429s
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=30,
+                overall_time_period=1,
+                group_max_rate=20,
+                group_time_period=60,
+                max_retries=3,
+            )
+        )
         .build()
     )
 
+    async def prune_old(context):
+        await store.run(store.prune_old, cfg.retention_days)
+
+    async def flush_stats(context):
+        await store.run(store.flush_stats)
+
+    async def sweep_sessions(context):
+        sessions.sweep()
+
+    # retention is enforced periodically instead of on every update
+    app.job_queue.run_repeating(prune_old, interval=3600, first=60)
+    # user stats are buffered by the store and written out in batches
+    app.job_queue.run_repeating(flush_stats, interval=30, first=30)
+    # idle Gemini chats (and the image they hold) are released even if the user never comes back
+    app.job_queue.run_repeating(sweep_sessions, interval=60, first=60)
+
     app.add_handler(CommandHandler("start", handlers.cmd_start))
     app.add_handler(CommandHandler("help", handlers.cmd_help))
     app.add_handler(CommandHandler("history", handlers.cmd_history))
@@ -43,7 +106,8 @@ async def create_application():
     app.add_handler(CommandHandler("clear", handlers.cmd_clear))
     app.add_handler(CommandHandler("stats", handlers.cmd_stats))
 
-    app.add_handler(MessageHandler(filters.PHOTO | (filters.TEXT & ~filters.COMMAND), handlers.handle_message))
+    app.add_handler(MessageHandler(filters.PHOTO, handlers.handle_photo))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_text))
 
     async def on_error(update, context):
         try:
@@ -1,14 +1,13 @@
+import functools
 import os
 from dataclasses import dataclass
 
 try:
     # Load variables from a local .env if present
     from dotenv import load_dotenv  # type: ignore
-
-    load_dotenv()
 except Exception:
     # If python-dotenv is not installed, environment variables can still be set externally
-    pass
+    load_dotenv = None
 
 
 @dataclass(frozen=True)
@@ -19,11 +18,25 @@ class Config:
     logs_dir: str = "logs"
     retention_days: int = 14
     idle_timeout_minutes: int = 60
-    admins: tuple[str, ...] = tuple()
+    admins: frozenset[int] = frozenset()
     system_prompt_path: str = "bot/system_prompt.txt"
+    storage_backend: str = "json"
+    redis_url: str = "redis://localhost:6379/0"
+    concurrent_updates: int = 256
+    connection_pool_size: int = 128
+    pool_timeout: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 30.0
+    get_updates_pool_timeout: float = 60.0
+    http_version: str = "2"
 
 
+@functools.lru_cache(maxsize=1)
 def load_config() -> Config:
+    # Cached: call load_config.cache_clear() to re-read the environment
+    # load_dotenv never overrides variables that are already exported
+    if load_dotenv is not None:
+        load_dotenv()
     telegram_token = os.getenv("TELEGRAM_TOKEN", "ВАШ_ТЕЛЕГРАМ_ТОКЕН")
     gemini_api_key = os.getenv("GEMINI_API_KEY", "ВАШ_GEMINI_API_КЛЮЧ")
     data_dir = os.getenv("DATA_DIR", "data")
@@ -31,10 +44,17 @@ def load_config() -> Config:
     retention_days = int(os.getenv("RETENTION_DAYS", "14"))
     idle_timeout_minutes = int(os.getenv("IDLE_TIMEOUT_MINUTES", "60"))
     system_prompt_path = os.getenv("SYSTEM_PROMPT_PATH", "bot/system_prompt.txt")
-    admin_ids_raw = os.getenv("ADMIN_CHAT_IDS", "").strip()
-    admins: tuple[str, ...] = tuple(
-        [a for a in admin_ids_raw.split(",") if a.strip()] if admin_ids_raw else []
-    )
+    storage_backend = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "256"))
+    connection_pool_size = int(os.getenv("CONNECTION_POOL_SIZE", "128"))
+    pool_timeout = float(os.getenv("POOL_TIMEOUT", "30"))
+    connect_timeout = float(os.getenv("CONNECT_TIMEOUT", "10"))
+    read_timeout = float(os.getenv("READ_TIMEOUT", "30"))
+    get_updates_pool_timeout = float(os.getenv("GET_UPDATES_POOL_TIMEOUT", "60"))
+    http_version = os.getenv("HTTP_VERSION", "2").strip()
+    admin_ids_raw = os.getenv("ADMIN_CHAT_IDS", "")
+    admins: frozenset[int] = frozenset(int(a) for a in admin_ids_raw.split(",") if a.strip())
     return Config(
         telegram_token=telegram_token,
         gemini_api_key=gemini_api_key,
@@ -44,6 +64,13 @@ def load_config() -> Config:
         idle_timeout_minutes=idle_timeout_minutes,
         admins=admins,
         system_prompt_path=system_prompt_path,
+        storage_backend=storage_backend,
+        redis_url=redis_url,
+        concurrent_updates=concurrent_updates,
+        connection_pool_size=connection_pool_size,
+        pool_timeout=pool_timeout,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        get_updates_pool_timeout=get_updates_pool_timeout,
+        http_version=http_version,
     )
-
-
@@ -1,27 +1,40 @@
 import asyncio
+import logging
 import os
 import tempfile
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Union
 
 import google.generativeai as genai
+from google.generativeai import protos
 from google.api_core.exceptions import FailedPrecondition, GoogleAPICallError
 
+logger = logging.getLogger(__name__)
+
+# Images below this size are sent inline with the request instead of via the File API
+INLINE_IMAGE_LIMIT = 15 * 1024 * 1024
+
+# Any buffer holding the downloaded image; bytes are passed through without a copy
+ImageBuffer = Union[bytes, bytearray, memoryview]
+
 
 class GeminiClient:
     def __init__(self, api_key: str, model: str = "gemini-1.5-flash", system_prompt: str | None = None) -> None:
         genai.configure(api_key=api_key)
         self.model_name = model
         self.system_prompt = system_prompt or ""
+        # Built once and reused for every chat and request
+        self._model = genai.GenerativeModel(self.model_name, system_instruction=self.system_prompt or None)
+        # pending File API deletions; referenced so they are not garbage-collected mid-flight
+        self._cleanup_tasks: Set["asyncio.Task[None]"] = set()
 
     def start_chat(self, history: Optional[List[Dict[str, Any]]] = None) -> Any:
-        model = genai.GenerativeModel(self.model_name, system_instruction=self.system_prompt or None)
         hist = []
         # system prompt is passed via system_instruction; no need to add a 'system' role turn here
         if history:
             hist.extend(history)
-        return model.start_chat(history=hist)
+        return self._model.start_chat(history=hist)
 
-    def _upload_file_from_bytes(self, image_bytes: bytes, mime_type: str) -> Any:
+    def _upload_file_from_bytes(self, image_bytes: ImageBuffer, mime_type: str) -> Any:
         # Writes to a temp file to use the official upload flow
         tmp = tempfile.NamedTemporaryFile(delete=False)
         try:
@@ -35,60 +48,25 @@ class GeminiClient:
             except Exception:
                 pass
 
-    async def generate_with_image_and_text(
-        self,
-        image_bytes: bytes,
-        mime_type: str,
-        text: str,
-    ) -> tuple[str, Any]:
-        model = genai.GenerativeModel(self.model_name)
-        # google-generativeai is sync; run in thread
-        def _call() -> Any:
-            uploaded = self._upload_file_from_bytes(image_bytes, mime_type)
-            return model.generate_content([uploaded, text])
-
-        # simple retries with backoff
-        attempt = 0
-        while True:
-            try:
-                resp = await asyncio.to_thread(_call)
-                return (resp.text or "", resp)
-            except FailedPrecondition as e:
-                raise RuntimeError("gemini_region_blocked") from e
-            except GoogleAPICallError as e:
-                attempt += 1
-                if attempt >= 2:
-                    raise RuntimeError("gemini_api_error") from e
-                await asyncio.sleep(0.8 * attempt)
-            except Exception as e:
-                attempt += 1
-                if attempt >= 2:
-                    raise RuntimeError("gemini_unknown_error") from e
-                await asyncio.sleep(0.8 * attempt)
+    async def _image_part(self, image_bytes: ImageBuffer, mime_type: str) -> Any:
+        # Inline small images: no upload round-trip and no temp file
+        if len(image_bytes) < INLINE_IMAGE_LIMIT:
+            # the SDK only accepts bytes for inline data; bytes(bytes) is not a copy
+            return {"mime_type": mime_type, "data": bytes(image_bytes)}
+        # upload_file has no async variant
+        return await asyncio.to_thread(self._upload_file_from_bytes, image_bytes, mime_type)
 
-    def build_history_with_image(self, image_bytes: bytes, mime_type: str, text: str) -> List[Dict[str, Any]]:
-        # Upload image and return a history turn referencing the uploaded file
-        uploaded = self._upload_file_from_bytes(image_bytes, mime_type)
-        return [
-            {
-                "role": "user",
-                "parts": [uploaded, text],
-            }
-        ]
-
-    async def start_chat_and_answer_first(self, image_bytes: bytes, mime_type: str, text: str) -> tuple[Any, str]:
+    async def start_chat_and_answer_first(self, image_bytes: ImageBuffer, mime_type: str, text: str) -> tuple[Any, str]:
         # Create chat with system_instruction applied and send first multimodal message in the chat
-        history = self.build_history_with_image(image_bytes, mime_type, text)
         chat = self.start_chat(history=[])
-
-        def _call() -> Any:
-            uploaded = self._upload_file_from_bytes(image_bytes, mime_type)
-            return chat.send_message([uploaded, text])
+        uploaded = None
 
         attempt = 0
         while True:
             try:
-                resp = await asyncio.to_thread(_call)
+                if uploaded is None:
+                    uploaded = await self._image_part(image_bytes, mime_type)
+                resp = await chat.send_message_async([uploaded, text])
                 return chat, (getattr(resp, "text", "") or "")
             except FailedPrecondition as e:
                 raise RuntimeError("gemini_region_blocked") from e
@@ -103,14 +81,46 @@ class GeminiClient:
                     raise RuntimeError("gemini_unknown_error") from e
                 await asyncio.sleep(0.8 * attempt)
 
-    async def send_chat_message(self, chat: Any, text: str) -> str:
-        def _call() -> Any:
-            return chat.send_message(text)
+    async def offload_first_image(self, chat: Any) -> Optional[str]:
+        # Swap the inline image of the first turn for a File API reference,
+        # so a session keeps only the file URI instead of the photo bytes.
+        # Returns the uploaded file name; the caller owns it and must pass it to delete_file_later()
+        try:
+            # keep the Content itself: reading chat.history again after the upload can raise
+            # if a follow-up turn finished meanwhile with a broken response
+            content = chat.history[0]
+            part = content.parts[0]
+            if "inline_data" not in part:
+                return None
+            blob = part.inline_data
+            uploaded = await asyncio.to_thread(self._upload_file_from_bytes, blob.data, blob.mime_type)
+        except Exception:
+            # the inline image stays in the history; the chat keeps working as before
+            logger.warning("Failed to offload image from chat history", exc_info=True)
+            return None
+        content.parts[0] = protos.Part(
+            file_data=protos.FileData(mime_type=uploaded.mime_type, file_uri=uploaded.uri)
+        )
+        return uploaded.name
+
+    def delete_file_later(self, name: str) -> None:
+        # Called from sync code on the event loop (session drop); delete_file has no async variant
+        task = asyncio.get_running_loop().create_task(self._delete_file(name))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
 
+    async def _delete_file(self, name: str) -> None:
+        try:
+            await asyncio.to_thread(genai.delete_file, name)
+        except Exception:
+            # the file expires on its own after 48 h
+            logger.warning("Failed to delete uploaded file %s", name, exc_info=True)
+
+    async def send_chat_message(self, chat: Any, text: str) -> str:
         attempt = 0
         while True:
             try:
-                resp = await asyncio.to_thread(_call)
+                resp = await chat.send_message_async(text)
                 return getattr(resp, "text", "") or ""
             except FailedPrecondition as e:
                 raise RuntimeError("gemini_region_blocked") from e
@@ -1,15 +1,22 @@
-import io
+import asyncio
+import functools
+import itertools
 import time
-from typing import Any, Dict, Optional
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 from telegram import Update
 from telegram.constants import ChatAction
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
 from .storage import JsonStore, DialogIndexEntry
 from .session import SessionManager, ActiveSession
 from .gemini import GeminiClient
 
+if TYPE_CHECKING:
+    from .redis_store import RedisStore
+
 
 WELCOME = (
     "Привет! Я бот, который анализирует фото и отвечает на вопросы по ним.\n"
@@ -21,46 +28,93 @@ CONTENT_WARNING = (
     "Предупреждение: изображения могут содержать чувствительный контент."
 )
 
+START_TEXT = WELCOME + "\n" + CONTENT_WARNING
+
+HELP_TEXT = (
+    "Как пользоваться:\n"
+    "- Отправьте фото с подписью-вопросом — начнется новый диалог.\n"
+    "- Пишите текстом — продолжение текущего диалога.\n"
+    "Команды:\n"
+    "/history [N] — показать последние N диалогов (по умолчанию 5).\n"
+    "/dialog <id> [full] — показать выжимку или полный диалог.\n"
+    "/clear [current|all] — очистка диалога или всей истории.\n"
+    "/stats [me|global] — статистика. global — только для админов.\n"
+)
+
+CLEAR_USAGE = "Использование: /clear [current|all]"
+
+DIALOG_USAGE = "Укажите id диалога: /dialog <id> [full]"
+
+REGION_BLOCKED = (
+    "К сожалению, доступ к модели ограничен по региону. Попробуйте позже или через другой регион."
+)
+
+MODEL_ERROR = "Не удалось получить ответ от модели. Попробуйте повторить запрос позже."
+
+
+@functools.lru_cache(maxsize=1024)
+def _fmt_minute(minute: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(minute * 60))
+
+
+def _fmt_ts(ts: float) -> str:
+    # the format has minute precision, so cache by minute
+    return _fmt_minute(int(ts) // 60)
+
+
+class _BytesSink:
+    # Writable target for File.download_to_memory that keeps the received bytes as-is
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(data)
+        return len(data)
+
+    def getvalue(self) -> bytes:
+        # PTB writes the whole file at once; bytes(bytes) returns the same object
+        if len(self._chunks) == 1:
+            return bytes(self._chunks[0])
+        return b"".join(self._chunks)
+
 
 class BotHandlers:
     def __init__(
         self,
-        store: JsonStore,
+        store: Union[JsonStore, "RedisStore"],
         sessions: SessionManager,
         gemini: GeminiClient,
-        retention_days: int,
-        admins: tuple[str, ...],
+        admins: frozenset[int],
     ) -> None:
         self.store = store
         self.sessions = sessions
         self.gemini = gemini
-        self.retention_days = retention_days
-        self.admins = set(admins)
+        self.admins = admins
+        # Updates run concurrently; messages of one user are still handled in order
+        self._user_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _user_lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._user_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[chat_id] = lock
+        return lock
 
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         u = update.effective_user
         if not u:
             return
-        self.store.init_user_if_needed(
+        await self.store.run(
+            self.store.init_user_if_needed,
             chat_id=u.id,
             username=u.username,
             first_name=u.first_name,
             last_name=u.last_name,
         )
-        await update.effective_message.reply_text(WELCOME + "\n" + CONTENT_WARNING)
+        await update.effective_message.reply_text(START_TEXT)
 
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        text = (
-            "Как пользоваться:\n"
-            "- Отправьте фото с подписью-вопросом — начнется новый диалог.\n"
-            "- Пишите текстом — продолжение текущего диалога.\n"
-            "Команды:\n"
-            "/history [N] — показать последние N диалогов (по умолчанию 5).\n"
-            "/dialog <id> [full] — показать выжимку или полный диалог.\n"
-            "/clear [current|all] — очистка диалога или всей истории.\n"
-            "/stats [me|global] — статистика. global — только для админов.\n"
-        )
-        await update.effective_message.reply_text(text)
+        await update.effective_message.reply_text(HELP_TEXT)
 
     async def cmd_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         u = update.effective_user
@@ -69,17 +123,17 @@ class BotHandlers:
         args = context.args or []
         scope = args[0].lower() if args else "me"
         if scope == "global":
-            if str(u.id) not in self.admins:
+            if u.id not in self.admins:
                 await update.effective_message.reply_text("Недостаточно прав.")
                 return
-            stats = self.store.global_stats()
+            stats = await self.store.run(self.store.global_stats)
             await update.effective_message.reply_text(
                 f"Пользователей: {stats['users']}, Диалогов: {stats['dialogs']}, Запросов: {stats['requests']}"
             )
         else:
-            stats = self.store.user_stats(u.id)
+            stats = await self.store.run(self.store.user_stats, u.id)
             last = stats.get("last_active_at")
-            last_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(last)) if last else "—"
+            last_str = _fmt_ts(last) if last else "—"
             await update.effective_message.reply_text(
                 f"Ваши статистика — Диалогов: {stats['dialogs']}, Запросов: {stats['requests']}, Последняя активность: {last_str}"
             )
@@ -88,20 +142,18 @@ class BotHandlers:
         u = update.effective_user
         if not u:
             return
-        # prune old on history
-        self.store.prune_old(self.retention_days)
         args = context.args or []
         try:
             limit = int(args[0]) if args else 5
         except ValueError:
             limit = 5
-        lst = self.store.list_dialogs(u.id, limit=limit)
+        lst = await self.store.run(self.store.list_dialogs, u.id, limit=limit)
         if not lst:
             await update.effective_message.reply_text("История пуста.")
             return
         lines = []
         for e in lst:
-            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(e.get("started_at", 0)))
+            started = _fmt_ts(e.get("started_at", 0))
             title = e.get("title") or "(без заголовка)"
             lines.append(f"• {e.get('dialog_id')} — {started}: {title}")
         await update.effective_message.reply_text("\n".join(lines))
@@ -110,26 +162,26 @@ class BotHandlers:
         u = update.effective_user
         if not u:
             return
-        self.store.prune_old(self.retention_days)
         if not context.args:
-            await update.effective_message.reply_text("Укажите id диалога: /dialog <id> [full]")
+            await update.effective_message.reply_text(DIALOG_USAGE)
             return
         dialog_id = context.args[0]
         full = len(context.args) > 1 and context.args[1].lower() == "full"
-        data = self.store.get_dialog(u.id, dialog_id)
+        data = await self.store.run(self.store.get_dialog_meta, u.id, dialog_id)
         if not data:
             await update.effective_message.reply_text("Диалог не найден.")
             return
         if full:
-            # Печатаем кратко, чтобы не перегрузить
-            msgs = data.get("messages", [])
+            # Печатаем кратко, чтобы не перегрузить; 51-е сообщение только показывает, что есть еще
+            msgs = await self.store.run(self.store.read_messages, u.id, dialog_id, 51)
             text = [f"Диалог {dialog_id}:"]
-            for m in msgs[:50]:
-                role = m.get("role")
+            append = text.append
+            for m in itertools.islice(msgs, 50):
                 t = m.get("text", "")
-                text.append(f"[{role}] {t[:800]}")
+                # slice only long texts; short ones are the common case
+                append(f"[{m.get('role')}] {t if len(t) <= 800 else t[:800]}")
             if len(msgs) > 50:
-                text.append("…(обрезано)" )
+                append("…(обрезано)")
             await update.effective_message.reply_text("\n".join(text))
         else:
             title = data.get("summary") or "(выжимка не сформирована)"
@@ -142,183 +194,196 @@ class BotHandlers:
         args = context.args or []
         mode = args[0].lower() if args else "current"
         if mode not in ("current", "all"):
-            await update.effective_message.reply_text("Использование: /clear [current|all]")
+            await update.effective_message.reply_text(CLEAR_USAGE)
             return
-        if mode == "current":
-            s = self.sessions.get(u.id)
-            if not s:
-                await update.effective_message.reply_text("Нет активного диалога.")
-                return
-            self.store.delete_dialog(u.id, s.dialog_id)
-            self.sessions.clear(u.id)
-            await update.effective_message.reply_text("Текущий диалог удален.")
-        else:
-            cnt = self.store.clear_all_dialogs(u.id)
-            self.sessions.clear(u.id)
-            await update.effective_message.reply_text(f"Удалено диалогов: {cnt}")
+        # wait for an in-flight photo/text of this user so it can't recreate what we delete
+        async with self._user_lock(u.id):
+            if mode == "current":
+                s = self.sessions.get(u.id)
+                if not s:
+                    await update.effective_message.reply_text("Нет активного диалога.")
+                    return
+                await self.store.run(self.store.delete_dialog, u.id, s.dialog_id)
+                self.sessions.clear(u.id)
+                await update.effective_message.reply_text("Текущий диалог удален.")
+            else:
+                cnt = await self.store.run(self.store.clear_all_dialogs, u.id)
+                self.sessions.clear(u.id)
+                await update.effective_message.reply_text(f"Удалено диалогов: {cnt}")
+
+    async def _send_typing(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+        # best-effort: a failed typing action must not abort the request it runs alongside
+        try:
+            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except TelegramError:
+            pass
 
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def _download_photo(self, photo: Any) -> bytes:
+        file = await photo.get_file()
+        sink = _BytesSink()
+        await file.download_to_memory(out=sink)
+        return sink.getvalue()
+
+    async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         msg = update.effective_message
         u = update.effective_user
         if not msg or not u:
             return
-        # prune old on each message
-        self.store.prune_old(self.retention_days)
-        self.store.init_user_if_needed(u.id, u.username, u.first_name, u.last_name)
-
-        # Фото
-        if msg.photo:
-            # Берем самое большое
-            photo = msg.photo[-1]
-            file = await photo.get_file()
-            bio = io.BytesIO()
-            await context.bot.send_chat_action(chat_id=msg.chat_id, action=ChatAction.TYPING)
-            await file.download_to_memory(out=bio)
-            image_bytes = bio.getvalue()
-            mime = "image/jpeg"
-            image_meta = {
-                "file_unique_id": photo.file_unique_id,
-                "width": photo.width,
-                "height": photo.height,
-                "size_bytes": len(image_bytes),
-                "mime": mime,
-            }
-            caption = msg.caption or "Опиши изображение, пожалуйста."
-
-            # новый диалог всегда на новое фото
-            dialog_id = time.strftime("%Y%m%d-%H%M%S")
-            self.store.open_dialog(u.id, dialog_id, model="gemini-1.5-flash", image_meta=image_meta, caption_text=caption)
-            self.store.add_dialog_index_entry(
-                u.id,
-                DialogIndexEntry(
-                    dialog_id=dialog_id,
-                    started_at=time.time(),
-                    closed_at=None,
-                    title="",
-                    has_image=True,
-                    message_count=0,
-                    tokens_estimate=0,
-                    warning_shown=True,
-                ),
+        async with self._user_lock(u.id):
+            await self._process_photo(msg, u, context)
+
+    async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        msg = update.effective_message
+        u = update.effective_user
+        if not msg or not u:
+            return
+        async with self._user_lock(u.id):
+            await self._process_text(msg, u, context)
+
+    async def _process_photo(self, msg: Any, u: Any, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = time.time()
+        await self.store.run(self.store.init_user_if_needed, u.id, u.username, u.first_name, u.last_name)
+
+        # Берем самое большое
+        photo = msg.photo[-1]
+        _, image_bytes = await asyncio.gather(
+            self._send_typing(context, msg.chat_id),
+            self._download_photo(photo),
+        )
+        mime = "image/jpeg"
+        image_meta = {
+            "file_unique_id": photo.file_unique_id,
+            "width": photo.width,
+            "height": photo.height,
+            "size_bytes": len(image_bytes),
+            "mime": mime,
+        }
+        caption = msg.caption or "Опиши изображение, пожалуйста."
+
+        # новый диалог всегда на новое фото
+        dialog_id = await self.store.run(self.store.next_dialog_id, u.id)
+
+        # Инициализация чата и первый ответ внутри одного и того же chat (с учетом system prompt)
+        try:
+            chat, answer = await self.gemini.start_chat_and_answer_first(
+                image_bytes=image_bytes,
+                mime_type=mime,
+                text=caption,
             )
+        except RuntimeError as e:
+            code = str(e)
+            await msg.reply_text(REGION_BLOCKED if code == "gemini_region_blocked" else MODEL_ERROR)
+            return
+        session = ActiveSession(
+            dialog_id=dialog_id,
+            gemini_chat=chat,
+            last_activity_at=time.monotonic(),
+            last_image_meta=image_meta,
+            message_seq=0,
+        )
+        self.sessions.set(u.id, session)
 
-            # Инициализация чата и первый ответ внутри одного и того же chat (с учетом system prompt)
-            try:
-                chat, answer = await self.gemini.start_chat_and_answer_first(
-                    image_bytes=image_bytes,
-                    mime_type=mime,
-                    text=caption,
-                )
-            except RuntimeError as e:
-                code = str(e)
-                if code == "gemini_region_blocked":
-                    await msg.reply_text(
-                        "К сожалению, доступ к модели ограничен по региону. Попробуйте позже или через другой регион."
-                    )
-                else:
-                    await msg.reply_text(
-                        "Не удалось получить ответ от модели. Попробуйте повторить запрос позже."
-                    )
-                return
-            session = ActiveSession(
+        # Запись диалога, индекса и первых сообщений одной транзакцией
+        session.message_seq += 1
+        user_msg = {
+            "message_id": session.message_seq,
+            "timestamp": now,
+            "role": "user",
+            "type": "image+text",
+            "text": caption,
+            "tokens_estimate": 0,
+            "latency_ms": 0,
+            "error": None,
+        }
+        session.message_seq += 1
+        assistant_msg = {
+            "message_id": session.message_seq,
+            "timestamp": now,
+            "role": "assistant",
+            "type": "text",
+            "text": answer,
+            "tokens_estimate": 0,
+            "latency_ms": 0,
+            "error": None,
+        }
+        await self.store.run(
+            self.store.open_and_seed_dialog,
+            u.id,
+            dialog_id,
+            model="gemini-1.5-flash",
+            image_meta=image_meta,
+            caption_text=caption,
+            entry=DialogIndexEntry(
                 dialog_id=dialog_id,
-                gemini_chat=chat,
-                last_activity_at=time.time(),
-                last_image_meta=image_meta,
-                message_seq=0,
-            )
-            self.sessions.set(u.id, session)
-
-            # Ответ уже получен внутри чата; просто отправим typing и продолжим сохранение
-            await context.bot.send_chat_action(chat_id=msg.chat_id, action=ChatAction.TYPING)
-
-            # Запись сообщений
-            session.message_seq += 1
-            self.store.append_message(
-                u.id,
-                dialog_id,
-                {
-                    "message_id": session.message_seq,
-                    "timestamp": time.time(),
-                    "role": "user",
-                    "type": "image+text",
-                    "text": caption,
-                    "tokens_estimate": 0,
-                    "latency_ms": 0,
-                    "error": None,
-                },
-            )
-            session.message_seq += 1
-            self.store.append_message(
-                u.id,
-                dialog_id,
-                {
-                    "message_id": session.message_seq,
-                    "timestamp": time.time(),
-                    "role": "assistant",
-                    "type": "text",
-                    "text": answer,
-                    "tokens_estimate": 0,
-                    "latency_ms": 0,
-                    "error": None,
-                },
-            )
-            await msg.reply_text(answer)
+                started_at=now,
+                closed_at=None,
+                title="",
+                has_image=True,
+                message_count=0,
+                tokens_estimate=0,
+                warning_shown=True,
+            ),
+            messages=[user_msg, assistant_msg],
+        )
+        await msg.reply_text(answer)
+        # upload after replying: the user does not wait for it
+        context.application.create_task(self._offload_image(u.id, session))
+
+    async def _offload_image(self, chat_id: int, session: ActiveSession) -> None:
+        name = await self.gemini.offload_first_image(session.gemini_chat)
+        if not name:
             return
+        if self.sessions.get(chat_id) is session:
+            # deleted by the session manager once the session is dropped
+            session.uploaded_file = name
+        else:
+            # the session was cleared or replaced while uploading
+            self.gemini.delete_file_later(name)
 
-        # Текст
-        if msg.text:
-            session = self.sessions.get(u.id)
-            if not session:
-                await msg.reply_text("Отправьте фото с подписью, чтобы начать новый диалог.")
-                return
-            prompt = msg.text
-            await context.bot.send_chat_action(chat_id=msg.chat_id, action=ChatAction.TYPING)
-            # Используем gemini chat для продолжения контекста (с ретраями)
-            try:
-                text = await self.gemini.send_chat_message(session.gemini_chat, prompt)
-            except RuntimeError as e:
-                code = str(e)
-                if code == "gemini_region_blocked":
-                    await msg.reply_text(
-                        "К сожалению, доступ к модели ограничен по региону. Попробуйте позже или через другой регион."
-                    )
-                else:
-                    await msg.reply_text(
-                        "Не удалось получить ответ от модели. Попробуйте повторить запрос позже."
-                    )
-                return
+    async def _process_text(self, msg: Any, u: Any, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = time.time()
+        await self.store.run(self.store.init_user_if_needed, u.id, u.username, u.first_name, u.last_name)
 
-            session.message_seq += 1
-            self.store.append_message(
-                u.id,
-                session.dialog_id,
-                {
-                    "message_id": session.message_seq,
-                    "timestamp": time.time(),
-                    "role": "user",
-                    "type": "text",
-                    "text": prompt,
-                    "tokens_estimate": 0,
-                    "latency_ms": 0,
-                    "error": None,
-                },
-            )
-            session.message_seq += 1
-            self.store.append_message(
-                u.id,
-                session.dialog_id,
-                {
-                    "message_id": session.message_seq,
-                    "timestamp": time.time(),
-                    "role": "assistant",
-                    "type": "text",
-                    "text": text,
-                    "tokens_estimate": 0,
-                    "latency_ms": 0,
-                    "error": None,
-                },
+        session = self.sessions.get(u.id)
+        if not session:
+            await msg.reply_text("Отправьте фото с подписью, чтобы начать новый диалог.")
+            return
+        prompt = msg.text
+        # Используем gemini chat для продолжения контекста (с ретраями)
+        try:
+            _, text = await asyncio.gather(
+                self._send_typing(context, msg.chat_id),
+                self.gemini.send_chat_message(session.gemini_chat, prompt),
             )
-            await msg.reply_text(text)
+        except RuntimeError as e:
+            code = str(e)
+            await msg.reply_text(REGION_BLOCKED if code == "gemini_region_blocked" else MODEL_ERROR)
+            return
+
+        session.last_activity_at = time.monotonic()
+        session.message_seq += 1
+        user_msg = {
+            "message_id": session.message_seq,
+            "timestamp": now,
+            "role": "user",
+            "type": "text",
+            "text": prompt,
+            "tokens_estimate": 0,
+            "latency_ms": 0,
+            "error": None,
+        }
+        session.message_seq += 1
+        assistant_msg = {
+            "message_id": session.message_seq,
+            "timestamp": now,
+            "role": "assistant",
+            "type": "text",
+            "text": text,
+            "tokens_estimate": 0,
+            "latency_ms": 0,
+            "error": None,
+        }
+        await self.store.run(self.store.append_messages, u.id, session.dialog_id, [user_msg, assistant_msg])
+        await msg.reply_text(text)
 
 
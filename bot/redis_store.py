@@ -0,0 +1,315 @@
+import time
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+import orjson
+import redis
+
+from .storage import DialogIndexEntry, StoreExecutor
+
+# Keys:
+#   users                           SET   of known chat ids
+#   user:{chat_id}                  HASH  profile + stats, values JSON-encoded
+#   user:{chat_id}:dialogs          ZSET  dialog ids scored by started_at
+#   user:{chat_id}:dialog_entries   HASH  dialog id -> JSON index entry
+#   dialog:{chat_id}:{id}:meta      HASH  dialog metadata, values JSON-encoded
+#   dialog:{chat_id}:{id}:msgs      LIST  JSON messages in order
+
+_STATS_FIELDS = ("total_requests", "total_dialogs", "last_active_at")
+
+
+class RedisStore(StoreExecutor):
+    """Redis-backed store with the same method surface as JsonStore."""
+
+    def __init__(self, url: str, io_workers: int = 4) -> None:
+        super().__init__(io_workers)
+        # Sync client: store calls already run in worker threads
+        self.r = redis.Redis.from_url(url, decode_responses=True)
+
+    def _user_key(self, chat_id: int) -> str:
+        return f"user:{chat_id}"
+
+    def _index_key(self, chat_id: int) -> str:
+        return f"user:{chat_id}:dialogs"
+
+    def _entries_key(self, chat_id: int) -> str:
+        return f"user:{chat_id}:dialog_entries"
+
+    def _meta_key(self, chat_id: int, dialog_id: str) -> str:
+        return f"dialog:{chat_id}:{dialog_id}:meta"
+
+    def _msgs_key(self, chat_id: int, dialog_id: str) -> str:
+        return f"dialog:{chat_id}:{dialog_id}:msgs"
+
+    @staticmethod
+    def _encode(mapping: Dict[str, Any]) -> Dict[str, bytes]:
+        return {k: orjson.dumps(v) for k, v in mapping.items()}
+
+    @staticmethod
+    def _decode(mapping: Dict[str, str]) -> Dict[str, Any]:
+        return {k: orjson.loads(v) for k, v in mapping.items()}
+
+    def load_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        raw = self.r.hgetall(self._user_key(chat_id))
+        if not raw:
+            return None
+        u = self._profile(raw)
+        u["dialogs_index"] = self._entries(chat_id, -1)
+        return u
+
+    def _profile(self, raw: Dict[str, str]) -> Dict[str, Any]:
+        # user hash -> profile dict with nested stats, without the dialog index
+        u = self._decode(raw)
+        u["stats"] = {k: u.pop(k) for k in _STATS_FIELDS if k in u}
+        return u
+
+    def save_user(self, user: Dict[str, Any]) -> None:
+        chat_id = user["chat_id"]
+        profile = {k: v for k, v in user.items() if k not in ("stats", "dialogs_index")}
+        profile.update(user.get("stats", {}))
+        pipe = self.r.pipeline()
+        pipe.sadd("users", chat_id)
+        pipe.hset(self._user_key(chat_id), mapping=self._encode(profile))
+        if "dialogs_index" in user:
+            pipe.delete(self._index_key(chat_id), self._entries_key(chat_id))
+            for e in user["dialogs_index"]:
+                self._add_entry(pipe, chat_id, e)
+        pipe.execute()
+
+    def flush_stats(self) -> int:
+        # counters are updated in place with HINCRBY; nothing is buffered
+        return 0
+
+    def init_user_if_needed(
+        self,
+        chat_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+        language: str = "ru",
+    ) -> Dict[str, Any]:
+        now = time.time()
+        key = self._user_key(chat_id)
+        pipe = self.r.pipeline()
+        # HSETNX keeps first_seen and counters of existing users intact
+        for field, value in (
+            ("chat_id", chat_id),
+            ("first_seen", now),
+            ("language", language),
+            ("total_requests", 0),
+            ("total_dialogs", 0),
+        ):
+            pipe.hsetnx(key, field, orjson.dumps(value))
+        pipe.hset(
+            key,
+            mapping=self._encode(
+                {
+                    "username": username,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "last_seen": now,
+                    "last_active_at": now,
+                }
+            ),
+        )
+        pipe.sadd("users", chat_id)
+        # profile comes back in the same round-trip; the dialog index is not read on this hot path
+        pipe.hgetall(key)
+        return self._profile(pipe.execute()[-1])
+
+    def _add_entry(self, pipe: Any, chat_id: int, entry: Dict[str, Any]) -> None:
+        pipe.zadd(self._index_key(chat_id), {entry["dialog_id"]: entry.get("started_at", 0)})
+        pipe.hset(self._entries_key(chat_id), entry["dialog_id"], orjson.dumps(entry))
+
+    def add_dialog_index_entry(self, chat_id: int, entry: DialogIndexEntry) -> None:
+        if not self.r.exists(self._user_key(chat_id)):
+            raise RuntimeError("User must be initialized before adding dialog entry")
+        pipe = self.r.pipeline()
+        self._add_entry(pipe, chat_id, asdict(entry))
+        pipe.hincrby(self._user_key(chat_id), "total_dialogs", 1)
+        pipe.execute()
+
+    def update_dialog_index_entry(self, chat_id: int, dialog_id: str, **updates: Any) -> None:
+        raw = self.r.hget(self._entries_key(chat_id), dialog_id)
+        if raw is None:
+            return
+        e = orjson.loads(raw)
+        e.update(updates)
+        pipe = self.r.pipeline()
+        self._add_entry(pipe, chat_id, e)
+        pipe.execute()
+
+    def next_dialog_id(self, chat_id: int) -> str:
+        seq = self.r.hincrby(self._user_key(chat_id), "dialog_seq", 1)
+        return f"{int(time.time())}-{seq:06d}"
+
+    def list_dialogs(self, chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        return self._entries(chat_id, limit - 1)
+
+    def _entries(self, chat_id: int, stop: int) -> List[Dict[str, Any]]:
+        # newest first; stop=-1 returns all entries
+        ids = self.r.zrevrange(self._index_key(chat_id), 0, stop)
+        if not ids:
+            return []
+        return [orjson.loads(e) for e in self.r.hmget(self._entries_key(chat_id), ids) if e is not None]
+
+    def _new_dialog_meta(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        model: str,
+        image_meta: Dict[str, Any],
+        caption_text: Optional[str],
+        started_at: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        now = time.time() if started_at is None else started_at
+        return {
+            "dialog_id": dialog_id,
+            "chat_id": chat_id,
+            "started_at": now,
+            "closed_at": None,
+            "model": model,
+            "language": "ru",
+            "image_meta": {**image_meta, "caption_text": caption_text, "received_at": now},
+            "summary": "",
+            "indices": {"keywords": [], "dates": [], "entities": []},
+            "limits": {"max_messages": 500},
+        }
+
+    def open_dialog(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        model: str,
+        image_meta: Dict[str, Any],
+        caption_text: Optional[str],
+    ) -> None:
+        meta = self._new_dialog_meta(chat_id, dialog_id, model, image_meta, caption_text)
+        pipe = self.r.pipeline()
+        pipe.delete(self._meta_key(chat_id, dialog_id), self._msgs_key(chat_id, dialog_id))
+        pipe.hset(self._meta_key(chat_id, dialog_id), mapping=self._encode(meta))
+        pipe.execute()
+
+    def open_and_seed_dialog(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        model: str,
+        image_meta: Dict[str, Any],
+        caption_text: Optional[str],
+        entry: DialogIndexEntry,
+        messages: List[Dict[str, Any]],
+    ) -> None:
+        if not self.r.exists(self._user_key(chat_id)):
+            raise RuntimeError("User must be initialized before adding dialog entry")
+        meta = self._new_dialog_meta(chat_id, dialog_id, model, image_meta, caption_text, entry.started_at)
+        pipe = self.r.pipeline()
+        pipe.delete(self._meta_key(chat_id, dialog_id), self._msgs_key(chat_id, dialog_id))
+        pipe.hset(self._meta_key(chat_id, dialog_id), mapping=self._encode(meta))
+        if messages:
+            pipe.rpush(self._msgs_key(chat_id, dialog_id), *(orjson.dumps(m) for m in messages))
+        self._add_entry(pipe, chat_id, asdict(entry))
+        pipe.hincrby(self._user_key(chat_id), "total_dialogs", 1)
+        pipe.hincrby(self._user_key(chat_id), "total_requests", len(messages))
+        pipe.execute()
+
+    def append_message(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        message: Dict[str, Any],
+    ) -> None:
+        self.append_messages(chat_id, dialog_id, [message])
+
+    def append_messages(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        messages: List[Dict[str, Any]],
+    ) -> None:
+        if not self.r.exists(self._meta_key(chat_id, dialog_id)):
+            raise FileNotFoundError(self._meta_key(chat_id, dialog_id))
+        pipe = self.r.pipeline()
+        pipe.rpush(self._msgs_key(chat_id, dialog_id), *(orjson.dumps(m) for m in messages))
+        pipe.hincrby(self._user_key(chat_id), "total_requests", len(messages))
+        pipe.execute()
+
+    def close_dialog(self, chat_id: int, dialog_id: str) -> None:
+        key = self._meta_key(chat_id, dialog_id)
+        if self.r.exists(key):
+            self.r.hset(key, "closed_at", orjson.dumps(time.time()))
+
+    def get_dialog_meta(self, chat_id: int, dialog_id: str) -> Optional[Dict[str, Any]]:
+        meta = self.r.hgetall(self._meta_key(chat_id, dialog_id))
+        return self._decode(meta) if meta else None
+
+    def read_messages(self, chat_id: int, dialog_id: str, limit: int) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        return [orjson.loads(m) for m in self.r.lrange(self._msgs_key(chat_id, dialog_id), 0, limit - 1)]
+
+    def get_dialog(self, chat_id: int, dialog_id: str) -> Optional[Dict[str, Any]]:
+        pipe = self.r.pipeline()
+        pipe.hgetall(self._meta_key(chat_id, dialog_id))
+        pipe.lrange(self._msgs_key(chat_id, dialog_id), 0, -1)
+        meta, msgs = pipe.execute()
+        if not meta:
+            return None
+        data = self._decode(meta)
+        data["messages"] = [orjson.loads(m) for m in msgs]
+        return data
+
+    def _delete_dialogs(self, chat_id: int, dialog_ids: List[str]) -> int:
+        if not dialog_ids:
+            return 0
+        keys = []
+        for dialog_id in dialog_ids:
+            keys.append(self._meta_key(chat_id, dialog_id))
+            keys.append(self._msgs_key(chat_id, dialog_id))
+        pipe = self.r.pipeline()
+        pipe.exists(*(self._meta_key(chat_id, d) for d in dialog_ids))
+        pipe.delete(*keys)
+        pipe.zrem(self._index_key(chat_id), *dialog_ids)
+        pipe.hdel(self._entries_key(chat_id), *dialog_ids)
+        return pipe.execute()[0]
+
+    def delete_dialog(self, chat_id: int, dialog_id: str) -> bool:
+        return self._delete_dialogs(chat_id, [dialog_id]) > 0
+
+    def clear_all_dialogs(self, chat_id: int) -> int:
+        return self._delete_dialogs(chat_id, self.r.zrange(self._index_key(chat_id), 0, -1))
+
+    def prune_old(self, days: int) -> int:
+        # remove dialogs older than days across all users
+        cutoff = time.time() - days * 86400
+        removed = 0
+        for chat_id in self.r.smembers("users"):
+            old = self.r.zrangebyscore(self._index_key(chat_id), "-inf", f"({cutoff}")
+            removed += self._delete_dialogs(int(chat_id), old)
+        return removed
+
+    def user_stats(self, chat_id: int) -> Dict[str, Any]:
+        pipe = self.r.pipeline()
+        pipe.zcard(self._index_key(chat_id))
+        pipe.hmget(self._user_key(chat_id), "total_requests", "last_active_at")
+        dialogs, (requests, last) = pipe.execute()
+        return {
+            "dialogs": dialogs,
+            "requests": orjson.loads(requests) if requests else 0,
+            "last_active_at": orjson.loads(last) if last else None,
+        }
+
+    def global_stats(self) -> Dict[str, Any]:
+        users = list(self.r.smembers("users"))
+        pipe = self.r.pipeline()
+        for chat_id in users:
+            pipe.zcard(self._index_key(chat_id))
+            pipe.hget(self._user_key(chat_id), "total_requests")
+        res = pipe.execute()
+        return {
+            "users": len(users),
+            "dialogs": sum(res[0::2]),
+            "requests": sum(int(r) for r in res[1::2] if r),
+        }
@@ -1,6 +1,7 @@
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
 
 @dataclass
@@ -10,27 +11,66 @@ class ActiveSession:
     last_activity_at: float
     last_image_meta: Dict[str, Any]
     message_seq: int = 0
+    # Gemini File API name of the offloaded photo; deleted when the session is dropped
+    uploaded_file: Optional[str] = None
+
+
+# Upper bound on live sessions; the least recently used one is dropped first
+MAX_SESSIONS = 10_000
 
 
 class SessionManager:
-    def __init__(self, idle_timeout_minutes: int) -> None:
-        self._sessions: Dict[int, ActiveSession] = {}
+    def __init__(
+        self,
+        idle_timeout_minutes: int,
+        max_sessions: int = MAX_SESSIONS,
+        on_drop: Optional[Callable[[ActiveSession], None]] = None,
+    ) -> None:
+        self._sessions: "OrderedDict[int, ActiveSession]" = OrderedDict()
         self._idle_seconds = idle_timeout_minutes * 60
+        self._max_sessions = max_sessions
+        # called for every session that is replaced, cleared, expired or evicted
+        self._on_drop = on_drop
+
+    def _drop(self, session: Optional[ActiveSession]) -> None:
+        if session is not None and self._on_drop is not None:
+            self._on_drop(session)
 
     def get(self, chat_id: int) -> Optional[ActiveSession]:
         s = self._sessions.get(chat_id)
         if not s:
             return None
-        if time.time() - s.last_activity_at > self._idle_seconds:
+        # last_activity_at is a time.monotonic() reading
+        if time.monotonic() - s.last_activity_at > self._idle_seconds:
             # idle timeout
-            self._sessions.pop(chat_id, None)
+            self._drop(self._sessions.pop(chat_id, None))
             return None
+        self._sessions.move_to_end(chat_id)
         return s
 
     def set(self, chat_id: int, session: ActiveSession) -> None:
+        old = self._sessions.get(chat_id)
         self._sessions[chat_id] = session
+        self._sessions.move_to_end(chat_id)
+        if old is not session:
+            self._drop(old)
+        while len(self._sessions) > self._max_sessions:
+            self._drop(self._sessions.popitem(last=False)[1])
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        # drop every idle session, not only the ones that get() happens to touch
+        if now is None:
+            now = time.monotonic()
+        expired = [
+            chat_id
+            for chat_id, s in self._sessions.items()
+            if now - s.last_activity_at > self._idle_seconds
+        ]
+        for chat_id in expired:
+            self._drop(self._sessions.pop(chat_id))
+        return len(expired)
 
     def clear(self, chat_id: int) -> None:
-        self._sessions.pop(chat_id, None)
+        self._drop(self._sessions.pop(chat_id, None))
 
 
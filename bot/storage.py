@@ -1,9 +1,30 @@
-import json
+import asyncio
+import bisect
+import functools
+import itertools
+import logging
 import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+def _locked(method: Callable[..., Any]) -> Callable[..., Any]:
+    # Store methods are called from worker threads; serialize file access
+    @functools.wraps(method)
+    def wrapper(self: "JsonStore", *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 @dataclass
@@ -31,41 +52,291 @@ class UserProfile:
     stats: Dict[str, Any]
 
 
-class JsonStore:
-    def __init__(self, base_dir: str) -> None:
+# Threads used to read many small files at once in global_stats
+_SCAN_WORKERS = 8
+
+
+def _load_stats(path: str) -> Tuple[int, int]:
+    # (dialogs, total_requests) for one users/<id>.json
+    try:
+        with open(path, "rb") as f:
+            u = orjson.loads(f.read())
+    except Exception:
+        return 0, 0
+    if "dialogs_index" in u:
+        dialogs = len(u["dialogs_index"])
+    else:
+        dialogs = 0
+        try:
+            with open(path[: -len(".json")] + ".idx.jsonl", "rb") as f:
+                dialogs = sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            pass
+    return dialogs, u.get("stats", {}).get("total_requests", 0)
+
+
+def _started_at(entry: Dict[str, Any]) -> float:
+    return entry.get("started_at", 0)
+
+
+def _dialog_id_from_name(name: str) -> Optional[str]:
+    # <id>.meta.json, or a legacy single-file <id>.json dialog
+    if name.endswith(".meta.json"):
+        return name[: -len(".meta.json")]
+    if name.endswith(".json"):
+        return name[: -len(".json")]
+    return None
+
+
+class StoreExecutor:
+    """Runs blocking store methods on a small pool owned by the store."""
+
+    def __init__(self, io_workers: int = 4) -> None:
+        # kept apart from the default executor so disk I/O never queues behind other to_thread work
+        self._executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="store")
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class JsonStore(StoreExecutor):
+    def __init__(self, base_dir: str, io_workers: int = 4) -> None:
+        super().__init__(io_workers)
         self.base = Path(base_dir)
         self.users_dir = self.base / "users"
         self.dialogs_dir = self.base / "dialogs"
-        self.tmp_dir = self.base / "tmp"
-        for d in (self.users_dir, self.dialogs_dir, self.tmp_dir):
+        self._lock = threading.RLock()
+        # write-through cache of parsed user files, most recently used last
+        self._user_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._user_cache_size = 4096
+        # dialog index per user, sorted by started_at ascending; mirrors users/<id>.idx.jsonl
+        self._index_cache: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+        # users whose cached profile has stats/activity changes not yet on disk; see flush_stats()
+        self._dirty_users: set[int] = set()
+        # append handles of recently written dialog logs, least recently used first
+        self._open_logs: "OrderedDict[Tuple[int, str], BinaryIO]" = OrderedDict()
+        self._open_logs_size = 256
+        # chats whose dialogs/<id> directory is known to exist
+        self._dir_exists: set[int] = set()
+        for d in (self.users_dir, self.dialogs_dir):
             d.mkdir(parents=True, exist_ok=True)
 
     def _user_path(self, chat_id: int) -> Path:
         return self.users_dir / f"{chat_id}.json"
 
-    def _dialog_path(self, chat_id: int, dialog_id: str) -> Path:
+    def _index_path(self, chat_id: int) -> Path:
+        return self.users_dir / f"{chat_id}.idx.jsonl"
+
+    # A dialog is a metadata file plus an append-only JSONL message log
+    def _dialog_dir(self, chat_id: int) -> Path:
         ddir = self.dialogs_dir / str(chat_id)
-        ddir.mkdir(parents=True, exist_ok=True)
-        return ddir / f"{dialog_id}.json"
+        # chat directories are never removed, so mkdir once per chat per process
+        if chat_id not in self._dir_exists:
+            ddir.mkdir(parents=True, exist_ok=True)
+            self._dir_exists.add(chat_id)
+        return ddir
+
+    def _meta_path(self, chat_id: int, dialog_id: str) -> Path:
+        return self._dialog_dir(chat_id) / f"{dialog_id}.meta.json"
+
+    def _log_path(self, chat_id: int, dialog_id: str) -> Path:
+        return self._dialog_dir(chat_id) / f"{dialog_id}.jsonl"
 
-    # Atomic write helper
+    def _legacy_path(self, chat_id: int, dialog_id: str) -> Path:
+        # single-file dialogs written by older versions
+        return self._dialog_dir(chat_id) / f"{dialog_id}.json"
+
+    def _write_log(self, path: Path, messages: List[Dict[str, Any]], mode: str) -> None:
+        with path.open(mode + "b") as f:
+            f.write(b"".join(orjson.dumps(m) + b"\n" for m in messages))
+
+    def _read_log(self, path: Path) -> List[Dict[str, Any]]:
+        return list(self._iter_log(path))
+
+    def _iter_log(self, path: Path, skipped: Optional[List[bytes]] = None) -> Iterator[Dict[str, Any]]:
+        # parses lazily, so a caller that stops early never reads the rest of the file
+        if not path.exists():
+            return
+        with path.open("rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # a torn line left by a crash or a full disk; the rest of the log is still usable
+                    logger.warning("Skipping unreadable line in %s", path)
+                    if skipped is not None:
+                        skipped.append(line)
+
+    @staticmethod
+    def _ensure_newline(path: Path) -> None:
+        # appends must start on a fresh line, not continue a torn one
+        try:
+            with path.open("rb+") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        except FileNotFoundError:
+            pass
+
+    def _log_handle(self, chat_id: int, dialog_id: str) -> BinaryIO:
+        key = (chat_id, dialog_id)
+        f = self._open_logs.get(key)
+        if f is not None:
+            self._open_logs.move_to_end(key)
+            return f
+        path = self._log_path(chat_id, dialog_id)
+        self._ensure_newline(path)
+        f = path.open("ab", buffering=64 * 1024)
+        self._open_logs[key] = f
+        if len(self._open_logs) > self._open_logs_size:
+            self._open_logs.popitem(last=False)[1].close()
+        return f
+
+    def _close_log(self, chat_id: int, dialog_id: str) -> None:
+        f = self._open_logs.pop((chat_id, dialog_id), None)
+        if f is not None:
+            f.close()
+
+    def _close_logs(self, chat_id: Optional[int] = None) -> None:
+        for key in [k for k in self._open_logs if chat_id is None or k[0] == chat_id]:
+            self._open_logs.pop(key).close()
+
+    def _delete_dialog_files(self, chat_id: int, dialog_id: str) -> bool:
+        self._close_log(chat_id, dialog_id)
+        existed = False
+        for p in (
+            self._meta_path(chat_id, dialog_id),
+            self._log_path(chat_id, dialog_id),
+            self._legacy_path(chat_id, dialog_id),
+        ):
+            try:
+                p.unlink()
+                existed = True
+            except FileNotFoundError:
+                pass
+        return existed
+
+    # Atomic write helpers
     def _atomic_write(self, path: Path, content: Dict[str, Any]) -> None:
-        tmp = self.tmp_dir / f"{path.name}.{int(time.time()*1000)}.tmp"
-        with tmp.open("w", encoding="utf-8") as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, path)
+        self._atomic_write_bytes(path, orjson.dumps(content, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+    def _atomic_write_bytes(self, path: Path, data: bytes) -> None:
+        # temp file next to the target so the replace is a same-directory rename;
+        # plain open() keeps the usual umask-based permissions, unlike NamedTemporaryFile's 0600
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with tmp.open("wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                tmp.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _load_index(self, chat_id: int) -> List[Dict[str, Any]]:
+        idx = self._index_cache.get(chat_id)
+        if idx is not None:
+            self._index_cache.move_to_end(chat_id)
+            return idx
+        path = self._index_path(chat_id)
+        if path.exists():
+            skipped: List[bytes] = []
+            idx = list(self._iter_log(path, skipped))
+            if skipped:
+                # drop the torn line now, so later appends never land on it
+                self._save_index(chat_id, idx)
+        else:
+            idx = []
+            # older versions kept the index inside the user file; move it out once
+            u = self.load_user(chat_id)
+            if u is not None and "dialogs_index" in u:
+                idx = u.pop("dialogs_index")
+                self._write_log(path, idx, "w")
+                self.save_user(u)
+        idx.sort(key=_started_at)
+        self._index_cache[chat_id] = idx
+        if len(self._index_cache) > self._user_cache_size:
+            self._index_cache.popitem(last=False)
+        return idx
+
+    def _save_index(self, chat_id: int, idx: List[Dict[str, Any]]) -> None:
+        self._atomic_write_bytes(self._index_path(chat_id), b"".join(orjson.dumps(e) + b"\n" for e in idx))
+
+    def _append_index(self, chat_id: int, entry: Dict[str, Any]) -> None:
+        idx = self._load_index(chat_id)
+        self._write_log(self._index_path(chat_id), [entry], "a")
+        # usually lands at the end; an out-of-order entry is placed without re-sorting
+        bisect.insort(idx, entry, key=_started_at)
+
+    def _remove_from_index(self, chat_id: int, dialog_ids: set[str]) -> None:
+        idx = self._load_index(chat_id)
+        kept = [e for e in idx if e.get("dialog_id") not in dialog_ids]
+        if len(kept) != len(idx):
+            idx[:] = kept
+            self._save_index(chat_id, idx)
 
+    @_locked
     def load_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        u = self._user_cache.get(chat_id)
+        if u is not None:
+            self._user_cache.move_to_end(chat_id)
+            return u
         p = self._user_path(chat_id)
         if not p.exists():
             return None
-        with p.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        u = orjson.loads(p.read_bytes())
+        self._cache_user(chat_id, u)
+        return u
+
+    def _cache_user(self, chat_id: int, user: Dict[str, Any]) -> None:
+        self._user_cache[chat_id] = user
+        self._user_cache.move_to_end(chat_id)
+        if len(self._user_cache) > self._user_cache_size:
+            old_id, old = self._user_cache.popitem(last=False)
+            if old_id in self._dirty_users:
+                self._dirty_users.discard(old_id)
+                self._atomic_write(self._user_path(old_id), old)
 
+    def _mark_dirty(self, user: Dict[str, Any]) -> None:
+        # counters change on every message; persist them in batches instead
+        self._cache_user(user["chat_id"], user)
+        self._dirty_users.add(user["chat_id"])
+
+    @_locked
     def save_user(self, user: Dict[str, Any]) -> None:
         p = self._user_path(user["chat_id"])
         self._atomic_write(p, user)
+        self._dirty_users.discard(user["chat_id"])
+        self._cache_user(user["chat_id"], user)
+
+    @_locked
+    def flush_stats(self) -> int:
+        # write out profiles changed by _mark_dirty(); returns the number of files written
+        dirty = list(self._dirty_users)
+        for chat_id in dirty:
+            u = self._user_cache.get(chat_id)
+            if u is not None:
+                self.save_user(u)
+        self._dirty_users.clear()
+        return len(dirty)
+
+    def close(self) -> None:
+        super().close()
+        self.flush_stats()
+        with self._lock:
+            self._close_logs()
 
+    @_locked
     def init_user_if_needed(
         self,
         chat_id: int,
@@ -85,48 +356,59 @@ class JsonStore:
                 "first_seen": now,
                 "last_seen": now,
                 "language": language,
-                "dialogs_index": [],
                 "stats": {
                     "total_requests": 0,
                     "total_dialogs": 0,
                     "last_active_at": now,
                 },
             }
+            self.save_user(u)
         else:
             u["last_seen"] = now
             u["stats"]["last_active_at"] = now
-        self.save_user(u)
+            self._mark_dirty(u)
         return u
 
+    @_locked
     def add_dialog_index_entry(self, chat_id: int, entry: DialogIndexEntry) -> None:
         u = self.load_user(chat_id)
         if u is None:
             raise RuntimeError("User must be initialized before adding dialog entry")
-        idx = u.get("dialogs_index", [])
-        idx.append(asdict(entry))
-        u["dialogs_index"] = idx
+        self._append_index(chat_id, asdict(entry))
         u["stats"]["total_dialogs"] = u["stats"].get("total_dialogs", 0) + 1
-        self.save_user(u)
+        self._mark_dirty(u)
 
+    @_locked
     def update_dialog_index_entry(self, chat_id: int, dialog_id: str, **updates: Any) -> None:
-        u = self.load_user(chat_id)
-        if u is None:
-            return
-        idx = u.get("dialogs_index", [])
+        idx = self._load_index(chat_id)
         for e in idx:
             if e.get("dialog_id") == dialog_id:
                 e.update(updates)
+                if "started_at" in updates:
+                    idx.sort(key=_started_at)
+                # only the index sidecar is rewritten, not the user profile
+                self._save_index(chat_id, idx)
                 break
-        self.save_user(u)
 
-    def list_dialogs(self, chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    @_locked
+    def next_dialog_id(self, chat_id: int) -> str:
+        # per-user counter: unique even for two photos within the same second
         u = self.load_user(chat_id)
         if u is None:
+            raise RuntimeError("User must be initialized before allocating a dialog id")
+        seq = u.get("dialog_seq", 0) + 1
+        u["dialog_seq"] = seq
+        self.save_user(u)
+        return f"{int(time.time())}-{seq:06d}"
+
+    @_locked
+    def list_dialogs(self, chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        if limit <= 0:
             return []
-        idx = list(u.get("dialogs_index", []))
-        idx.sort(key=lambda e: e.get("started_at", 0), reverse=True)
-        return idx[:limit]
+        # the index is kept sorted, newest last
+        return [dict(e) for e in reversed(self._load_index(chat_id)[-limit:])]
 
+    @_locked
     def open_dialog(
         self,
         chat_id: int,
@@ -135,9 +417,24 @@ class JsonStore:
         image_meta: Dict[str, Any],
         caption_text: Optional[str],
     ) -> None:
-        path = self._dialog_path(chat_id, dialog_id)
-        now = time.time()
-        data = {
+        self._atomic_write(
+            self._meta_path(chat_id, dialog_id),
+            self._new_dialog(chat_id, dialog_id, model, image_meta, caption_text),
+        )
+        self._close_log(chat_id, dialog_id)
+        self._write_log(self._log_path(chat_id, dialog_id), [], "w")
+
+    def _new_dialog(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        model: str,
+        image_meta: Dict[str, Any],
+        caption_text: Optional[str],
+        started_at: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        now = time.time() if started_at is None else started_at
+        return {
             "dialog_id": dialog_id,
             "chat_id": chat_id,
             "started_at": now,
@@ -145,136 +442,200 @@ class JsonStore:
             "model": model,
             "language": "ru",
             "image_meta": {**image_meta, "caption_text": caption_text, "received_at": now},
-            "messages": [],
             "summary": "",
             "indices": {"keywords": [], "dates": [], "entities": []},
             "limits": {"max_messages": 500},
         }
-        self._atomic_write(path, data)
 
+    @_locked
+    def open_and_seed_dialog(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        model: str,
+        image_meta: Dict[str, Any],
+        caption_text: Optional[str],
+        entry: DialogIndexEntry,
+        messages: List[Dict[str, Any]],
+    ) -> None:
+        # open_dialog + add_dialog_index_entry + append_messages with one write per file
+        u = self.load_user(chat_id)
+        if u is None:
+            raise RuntimeError("User must be initialized before adding dialog entry")
+        self._atomic_write(
+            self._meta_path(chat_id, dialog_id),
+            # same start time as the index entry
+            self._new_dialog(chat_id, dialog_id, model, image_meta, caption_text, entry.started_at),
+        )
+        self._close_log(chat_id, dialog_id)
+        self._write_log(self._log_path(chat_id, dialog_id), messages, "w")
+        self._append_index(chat_id, asdict(entry))
+        stats = u.setdefault("stats", {})
+        stats["total_dialogs"] = stats.get("total_dialogs", 0) + 1
+        stats["total_requests"] = stats.get("total_requests", 0) + len(messages)
+        self._mark_dirty(u)
+
+    @_locked
     def append_message(
         self,
         chat_id: int,
         dialog_id: str,
         message: Dict[str, Any],
     ) -> None:
-        path = self._dialog_path(chat_id, dialog_id)
-        if not path.exists():
-            raise FileNotFoundError(str(path))
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        msgs = data.get("messages", [])
-        msgs.append(message)
-        data["messages"] = msgs
-        self._atomic_write(path, data)
+        self.append_messages(chat_id, dialog_id, [message])
+
+    @_locked
+    def append_messages(
+        self,
+        chat_id: int,
+        dialog_id: str,
+        messages: List[Dict[str, Any]],
+    ) -> None:
+        if not self._meta_path(chat_id, dialog_id).exists():
+            raise FileNotFoundError(str(self._log_path(chat_id, dialog_id)))
+        # append-only through a cached handle: no open/close and no rewrite of earlier messages
+        f = self._log_handle(chat_id, dialog_id)
+        f.write(b"".join(orjson.dumps(m) + b"\n" for m in messages))
+        # readers open the file separately, so nothing stays in the buffer between calls
+        f.flush()
         # update user stats message count
         u = self.load_user(chat_id)
         if u:
             u.setdefault("stats", {})
-            u["stats"]["total_requests"] = u["stats"].get("total_requests", 0) + 1
-            self.save_user(u)
+            u["stats"]["total_requests"] = u["stats"].get("total_requests", 0) + len(messages)
+            self._mark_dirty(u)
 
+    @_locked
     def close_dialog(self, chat_id: int, dialog_id: str) -> None:
-        path = self._dialog_path(chat_id, dialog_id)
+        self._close_log(chat_id, dialog_id)
+        path = self._meta_path(chat_id, dialog_id)
         if not path.exists():
             return
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = orjson.loads(path.read_bytes())
         data["closed_at"] = time.time()
         self._atomic_write(path, data)
 
+    @_locked
+    def get_dialog_meta(self, chat_id: int, dialog_id: str) -> Optional[Dict[str, Any]]:
+        # dialog metadata without reading the message log
+        path = self._meta_path(chat_id, dialog_id)
+        if path.exists():
+            return orjson.loads(path.read_bytes())
+        legacy = self._legacy_path(chat_id, dialog_id)
+        if legacy.exists():
+            data = orjson.loads(legacy.read_bytes())
+            data.pop("messages", None)
+            return data
+        return None
+
+    @_locked
+    def read_messages(self, chat_id: int, dialog_id: str, limit: int) -> List[Dict[str, Any]]:
+        # first `limit` messages; only that many lines are read and parsed
+        path = self._log_path(chat_id, dialog_id)
+        if not path.exists():
+            legacy = self._legacy_path(chat_id, dialog_id)
+            if not legacy.exists():
+                return []
+            return orjson.loads(legacy.read_bytes()).get("messages", [])[:limit]
+        return list(itertools.islice(self._iter_log(path), limit))
+
+    @_locked
     def get_dialog(self, chat_id: int, dialog_id: str) -> Optional[Dict[str, Any]]:
-        path = self._dialog_path(chat_id, dialog_id)
+        path = self._meta_path(chat_id, dialog_id)
         if not path.exists():
-            return None
-        with path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+            legacy = self._legacy_path(chat_id, dialog_id)
+            if not legacy.exists():
+                return None
+            return orjson.loads(legacy.read_bytes())
+        data = orjson.loads(path.read_bytes())
+        data["messages"] = self._read_log(self._log_path(chat_id, dialog_id))
+        return data
 
+    @_locked
     def delete_dialog(self, chat_id: int, dialog_id: str) -> bool:
-        # remove dialog file and index entry
-        path = self._dialog_path(chat_id, dialog_id)
-        existed = path.exists()
-        if existed:
-            try:
-                path.unlink()
-            except Exception:
-                existed = False
-        u = self.load_user(chat_id)
-        if u is not None:
-            idx = [e for e in u.get("dialogs_index", []) if e.get("dialog_id") != dialog_id]
-            u["dialogs_index"] = idx
-            self.save_user(u)
+        # remove dialog files and index entry
+        try:
+            existed = self._delete_dialog_files(chat_id, dialog_id)
+        except Exception:
+            existed = False
+        self._remove_from_index(chat_id, {dialog_id})
         return existed
 
+    @_locked
     def clear_all_dialogs(self, chat_id: int) -> int:
         # delete all dialogs for user
+        self._close_logs(chat_id)
         ddir = self.dialogs_dir / str(chat_id)
         count = 0
         if ddir.exists():
-            for p in ddir.glob("*.json"):
+            for p in ddir.glob("*.json*"):
                 try:
                     p.unlink()
-                    count += 1
+                    # one .meta.json (or legacy .json) per dialog
+                    if p.suffix == ".json":
+                        count += 1
                 except Exception:
                     pass
-        u = self.load_user(chat_id)
-        if u is not None:
-            u["dialogs_index"] = []
-            self.save_user(u)
+        idx = self._load_index(chat_id)
+        if idx:
+            idx.clear()
+            self._save_index(chat_id, idx)
         return count
 
+    @_locked
     def prune_old(self, days: int) -> int:
         # remove dialogs older than days across all users
         cutoff = time.time() - days * 86400
         removed = 0
-        for chat_dir in self.dialogs_dir.glob("*"):
-            if not chat_dir.is_dir():
-                continue
-            chat_id = int(chat_dir.name) if chat_dir.name.isdigit() else None
-            for p in chat_dir.glob("*.json"):
-                try:
-                    with p.open("r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    started = float(data.get("started_at", 0))
-                except Exception:
-                    started = 0
-                if started and started < cutoff:
-                    try:
-                        dialog_id = data.get("dialog_id")
-                        p.unlink()
-                        removed += 1
-                        if chat_id is not None and dialog_id:
-                            u = self.load_user(chat_id)
-                            if u:
-                                idx = [e for e in u.get("dialogs_index", []) if e.get("dialog_id") != dialog_id]
-                                u["dialogs_index"] = idx
-                                self.save_user(u)
-                    except Exception:
-                        pass
+        with os.scandir(self.dialogs_dir) as chat_dirs:
+            for chat_dir in chat_dirs:
+                if not chat_dir.is_dir():
+                    continue
+                chat_id = int(chat_dir.name) if chat_dir.name.isdigit() else None
+                pruned: set[str] = set()
+                with os.scandir(chat_dir.path) as it:
+                    for entry in it:
+                        dialog_id = _dialog_id_from_name(entry.name)
+                        if dialog_id is None or dialog_id in pruned:
+                            continue
+                        # meta files are written at start and on close, so mtime >= started_at;
+                        # anything touched after the cutoff is kept without opening it
+                        try:
+                            if entry.stat().st_mtime >= cutoff:
+                                continue
+                            if chat_id is None:
+                                os.unlink(entry.path)
+                            else:
+                                self._delete_dialog_files(chat_id, dialog_id)
+                                pruned.add(dialog_id)
+                            removed += 1
+                        except OSError:
+                            pass
+                if pruned:
+                    # one index rewrite per user
+                    self._remove_from_index(chat_id, pruned)
         return removed
 
+    @_locked
     def user_stats(self, chat_id: int) -> Dict[str, Any]:
         u = self.load_user(chat_id) or {}
-        idx = u.get("dialogs_index", [])
         return {
-            "dialogs": len(idx),
+            "dialogs": len(self._load_index(chat_id)),
             "requests": (u.get("stats", {}).get("total_requests", 0)),
             "last_active_at": u.get("stats", {}).get("last_active_at"),
         }
 
     def global_stats(self) -> Dict[str, Any]:
-        users = list(self.users_dir.glob("*.json"))
+        # counts are read from disk; only the flush needs the store lock (flush_stats takes it).
+        # The scan runs unlocked: profiles are swapped in with os.replace and index lines are only counted
+        self.flush_stats()
+        with os.scandir(self.users_dir) as it:
+            users = [e.path for e in it if e.name.endswith(".json")]
         total_users = len(users)
-        total_dialogs = 0
-        total_requests = 0
-        for p in users:
-            try:
-                with p.open("r", encoding="utf-8") as f:
-                    u = json.load(f)
-                total_dialogs += len(u.get("dialogs_index", []))
-                total_requests += u.get("stats", {}).get("total_requests", 0)
-            except Exception:
-                pass
+        with ThreadPoolExecutor(max_workers=_SCAN_WORKERS) as ex:
+            results = list(ex.map(_load_stats, users))
+        total_dialogs = sum(d for d, _ in results)
+        total_requests = sum(r for _, r in results)
         return {
             "users": total_users,
             "dialogs": total_dialogs,
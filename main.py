@@ -29,6 +29,9 @@ async def amain() -> None:
         await application.updater.stop()
         await application.stop()
         await application.shutdown()
+        # post_shutdown is only run automatically by run_polling()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
 
 
 if __name__ == "__main__":